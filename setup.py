@@ -0,0 +1,18 @@
+"""Optional mypyc build for flowreg-hooks.
+
+All metadata lives in pyproject.toml. By default this builds the usual pure-Python
+package. Set FLOWREG_HOOKS_MYPYC=1 (with mypy installed in the build environment)
+to compile check_readme_images to a C extension instead.
+"""
+
+import os
+
+from setuptools import setup
+
+ext_modules = []
+if os.environ.get("FLOWREG_HOOKS_MYPYC") == "1":
+    from mypyc.build import mypycify
+
+    ext_modules = mypycify(["src/flowreg_hooks/check_readme_images.py"])
+
+setup(ext_modules=ext_modules)
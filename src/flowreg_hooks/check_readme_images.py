@@ -4,35 +4,89 @@ This hook rewrites relative image paths to absolute GitHub raw URLs.
 Exits with non-zero code if changes were made (standard pre-commit behavior).
 """
 
-import argparse
+import os
 import re
 import subprocess
 import sys
+import time
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import NoReturn
+
+from flowreg_hooks import __version__
 
 
 ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".svg"}
 
+# Remembers files that needed no normalization, keyed by (mtime, size)
+_CACHE_PATH = Path(".git", "flowreg-hooks-cache.json")
 
-def get_git_info() -> tuple[str, str] | None:
-    """Get GitHub repository info from git remote.
+
+@lru_cache(maxsize=8)
+def _compile_image_patterns(
+    allowed_extensions: frozenset[str],
+) -> tuple[re.Pattern[str], re.Pattern[str]]:
+    """Compile the Markdown and HTML image link patterns for a set of allowed extensions.
+
+    Absolute URLs and disallowed extensions are rejected by the patterns themselves,
+    and a leading ./ or / is left outside the captured path, so every match is a
+    link that needs rewriting. Compiled patterns are cached per allow-list.
 
     Returns:
-        tuple: (owner/repo, current commit SHA) or None if not a valid GitHub repo
+        tuple: (Markdown pattern for ![alt](url), HTML pattern for <img src="url">)
     """
-    # Get remote URL (check=False to handle missing origin gracefully)
-    result = subprocess.run(
-        ["git", "config", "--get", "remote.origin.url"],
-        capture_output=True,
-        text=True,
-        check=False,
+    # (?!) never matches, so an empty allow-list rewrites nothing
+    extensions = "|".join(re.escape(ext) for ext in sorted(allowed_extensions)) or "(?!)"
+    # Only the extension is case-insensitive, so the regex engine can still scan
+    # for the literal "![" prefix
+    markdown = re.compile(
+        r'(!\[[^\]]*\]\()(?!https?://)(?:\./)?/*'
+        rf'([^)]*(?i:{extensions}))(\))'
     )
+    # The src attribute must follow whitespace, so a rejected src can't make the
+    # match backtrack onto attributes like data-src
+    html = re.compile(
+        r'(<img\s+(?:[^>]*\s)?src=")(?!https?://)(?:\./)?/*'
+        rf'([^"]*(?:{extensions}))("[^>]*>)',
+        re.IGNORECASE,
+    )
+    return markdown, html
 
-    if result.returncode != 0:
-        # No origin remote configured
+
+_MD_IMG_RE, _HTML_IMG_RE = _compile_image_patterns(frozenset(ALLOWED_EXTENSIONS))
+
+# Sentinels for image markup in raw file bytes
+_MD_MARKER_RE = re.compile(rb"!\[")
+_HTML_MARKER_RE = re.compile(rb"<img", re.IGNORECASE)
+
+
+def _start_git(*args: str) -> subprocess.Popen[bytes]:
+    """Start a git command with captured stdout without waiting for it."""
+    # stderr is never inspected, so don't spend a pipe on it
+    return subprocess.Popen(
+        ["git", *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _git_output(process: subprocess.Popen[bytes]) -> str | None:
+    """Wait for a git command and return its stripped stdout, or None on failure."""
+    # stdout is the only pipe, so read it directly; leaving the block waits for exit.
+    # (communicate() would return None for stderr, which its type stubs don't allow.)
+    with process:
+        stdout = process.stdout.read() if process.stdout is not None else b""
+    if process.returncode != 0:
         return None
+    # Outputs are a SHA or a remote URL; decode directly instead of via text mode
+    return stdout.decode("utf-8", "replace").strip()
 
-    remote_url = result.stdout.strip()
+
+def _parse_repo_path(remote_url: str | None) -> str | None:
+    """Extract owner/repo from a GitHub remote URL, or None if it isn't one."""
+    if remote_url is None:
+        # No origin remote configured
+        return None
 
     # Parse owner/repo from various GitHub URL formats
     # https://github.com/owner/repo.git
@@ -42,25 +96,57 @@ def get_git_info() -> tuple[str, str] | None:
         # Not a GitHub repository
         return None
 
-    repo_path = match.group(1)
+    return match.group(1)
 
-    # Get current commit SHA (default ref)
-    result = subprocess.run(
-        ["git", "rev-parse", "HEAD"],
-        capture_output=True,
-        text=True,
-        check=False,
-    )
 
-    if result.returncode != 0:
-        # No commits yet (initial repository state)
+@lru_cache(maxsize=1)
+def _get_repo_path() -> str | None:
+    """Get owner/repo from the origin remote without resolving HEAD.
+
+    Used when an explicit ref is given, so the commit SHA isn't needed.
+    """
+    return _parse_repo_path(_git_output(_start_git("config", "--get", "remote.origin.url")))
+
+
+@lru_cache(maxsize=1)
+def get_git_info() -> tuple[str, str] | None:
+    """Get GitHub repository info from git remote.
+
+    The result is cached for the lifetime of the process, since the remote
+    and HEAD do not change while the hook runs.
+
+    Returns:
+        tuple: (owner/repo, current commit SHA) or None if not a valid GitHub repo
+    """
+    # Start both queries up front so the two git processes run concurrently. No single
+    # git command reports both values, and an "sh -c" chain only adds a third process.
+    remote_proc = _start_git("config", "--get", "remote.origin.url")
+    head_proc = _start_git("rev-parse", "HEAD")
+
+    repo_path = _parse_repo_path(_git_output(remote_proc))
+    commit_sha = _git_output(head_proc)
+
+    if repo_path is None:
         return None
 
-    commit_sha = result.stdout.strip()
+    if commit_sha is None:
+        # No commits yet (initial repository state)
+        return None
 
     return repo_path, commit_sha
 
 
+def _invalidate_git_info_cache() -> None:
+    """Forget the cached results of get_git_info() and _get_repo_path()."""
+    get_git_info.cache_clear()
+    _get_repo_path.cache_clear()
+
+
+def _replace_image(base_url: str, match: re.Match[str]) -> str:
+    """Rewrite a single Markdown or HTML image match to an absolute URL."""
+    return f"{match[1]}{base_url}{match[2]}{match[3]}"
+
+
 def normalize_image_urls(
     content: str,
     base_url: str,
@@ -74,67 +160,153 @@ def normalize_image_urls(
         allowed_extensions: Set of allowed image file extensions
 
     Returns:
-        str: Content with normalized image URLs
+        str: Content with normalized image URLs (the ``content`` object itself if
+        nothing needed rewriting)
     """
-
-    def is_allowed_image(path: str) -> bool:
-        """Check if path has an allowed image extension."""
-        return any(path.lower().endswith(ext) for ext in allowed_extensions)
-
-    def normalize_path(path: str) -> str:
-        """Normalize relative path by removing leading ./ and ensuring it's not absolute URL."""
-        if path.startswith(("http://", "https://")):
-            return path  # Already absolute
-        return path.lstrip("./")
-
-    # Handle Markdown image syntax: ![alt](url)
-    def replace_markdown(match):
-        prefix = match.group(1)
-        url = match.group(2)
-        suffix = match.group(3)
-
-        # Skip if already absolute URL
-        if url.startswith(("http://", "https://")):
-            return match.group(0)
-
-        # Only process allowed image extensions
-        if not is_allowed_image(url):
-            return match.group(0)
-
-        normalized = normalize_path(url)
-        return f"{prefix}{base_url}{normalized}{suffix}"
-
-    content = re.sub(
-        r'(!\[[^\]]*\]\()((?!https?://)[^)]+)(\))',
-        replace_markdown,
-        content,
+    if allowed_extensions is ALLOWED_EXTENSIONS:
+        markdown, html = _MD_IMG_RE, _HTML_IMG_RE
+    else:
+        markdown, html = _compile_image_patterns(frozenset(allowed_extensions))
+
+    # Both patterns start with a literal the regex engine scans for directly, so
+    # content without image markup costs one cheap scan per pattern. Every match is
+    # rewritten, and re.sub returns the same object when nothing matched, so
+    # callers can detect a no-op by identity
+    replace = partial(_replace_image, base_url)
+    content = markdown.sub(replace, content)
+    return html.sub(replace, content)
+
+
+def _has_image_markup(data: bytes) -> bool:
+    """Cheap check for Markdown or HTML image markup in raw file contents."""
+    # Literal-prefix regex scans beat bytes.__contains__ and avoid a lowered copy
+    return (
+        _MD_MARKER_RE.search(data) is not None or _HTML_MARKER_RE.search(data) is not None
     )
 
-    # Handle HTML img tags: <img src="url">
-    def replace_html(match):
-        prefix = match.group(1)
-        url = match.group(2)
-        suffix = match.group(3)
 
-        # Skip if already absolute URL
-        if url.startswith(("http://", "https://")):
-            return match.group(0)
+def _load_clean_files() -> dict[str, list[int]]:
+    """Load the cache of files known to need no normalization.
 
-        # Only process allowed image extensions
-        if not is_allowed_image(url):
-            return match.group(0)
+    Returns:
+        dict: Filename -> [st_mtime_ns, st_size]; empty if missing, unreadable or
+        written by a different hook version
+    """
+    try:
+        text = _CACHE_PATH.read_text(encoding="utf-8")
+    except (OSError, ValueError):
+        return {}
+    # Imported only once there is a cache to parse, so first runs don't pay for it
+    import json
 
-        normalized = normalize_path(url)
-        return f"{prefix}{base_url}{normalized}{suffix}"
+    try:
+        cache = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != __version__:
+        return {}
+    files = cache.get("files")
+    return files if isinstance(files, dict) else {}
 
-    content = re.sub(
-        r'(<img\s+[^>]*src=")([^"]+)("[^>]*>)',
-        replace_html,
-        content,
-        flags=re.IGNORECASE,
-    )
 
-    return content
+def _save_clean_files(files: dict[str, list[int]]) -> None:
+    """Persist the clean-file cache; silently skipped outside a git checkout."""
+    if not _CACHE_PATH.parent.is_dir():
+        return
+    import json
+
+    try:
+        cache = {"version": __version__, "files": files}
+        _CACHE_PATH.write_text(json.dumps(cache), encoding="utf-8")
+    except OSError:
+        pass
+
+
+def _record_clean(clean_files: dict[str, list[int]], filename: str, st: os.stat_result) -> bool:
+    """Record a file as needing no normalization, keyed by its mtime and size.
+
+    Returns:
+        bool: True if recorded; mtimes too recent to trust are skipped, since a
+        same-tick rewrite would otherwise go unnoticed
+    """
+    if time.time_ns() - st.st_mtime_ns <= 2_000_000_000:
+        return False
+    clean_files[filename] = [st.st_mtime_ns, st.st_size]
+    return True
+
+
+def _write_atomic(filepath: Path, data: bytes) -> None:
+    """Replace a file's contents via a temporary file and an atomic rename.
+
+    The original file is never left partially written. Symlinks are followed so the
+    link target is updated, not the link itself. Only the permission bits are
+    carried over: the rename replaces the inode, so hard links to the old file are
+    broken and owner/group become those of the user running the hook.
+
+    If the temporary file can't be created or renamed into place (e.g. on Windows
+    when another process has the file open), the file is written in place instead.
+    """
+    # Only needed when a file is rewritten, so kept off the check path
+    import contextlib
+    import shutil
+    import tempfile
+
+    target = Path(os.path.realpath(filepath))
+    try:
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.")
+    except PermissionError:
+        target.write_bytes(data)
+        return
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        shutil.copymode(target, tmp_name)
+        os.replace(tmp_name, target)
+    except BaseException as e:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_name)
+        if not isinstance(e, PermissionError):
+            raise
+        target.write_bytes(data)
+
+
+def _process_content(
+    filepath: Path,
+    original_content: str,
+    base_url: str,
+    check_only: bool,
+) -> bool | None:
+    """Check or rewrite the already decoded contents of a README file.
+
+    Returns:
+        bool | None: True if changes were made/needed, False if none were needed,
+        None if writing the changes failed
+    """
+    if check_only:
+        # Every pattern match needs rewriting, so the first one settles it
+        if (
+            _MD_IMG_RE.search(original_content) is None
+            and _HTML_IMG_RE.search(original_content) is None
+        ):
+            return False
+        print(f"{filepath}: Image URLs need normalization (use without --check-only to fix)")
+        return True
+
+    normalized_content = normalize_image_urls(original_content, base_url)
+
+    if normalized_content is original_content:
+        # No changes needed
+        return False
+
+    # Write raw bytes to preserve original line endings
+    try:
+        _write_atomic(filepath, normalized_content.encode("utf-8"))
+        print(f"{filepath}: Normalized image URLs")
+        return True
+    except Exception as e:
+        print(f"Error writing {filepath}: {e}", file=sys.stderr)
+        return None
 
 
 def process_file(
@@ -152,37 +324,92 @@ def process_file(
     Returns:
         bool: True if changes were made/needed, False otherwise
     """
-    if not filepath.exists():
+    try:
+        # Read raw bytes so original line endings (LF, CRLF, or mixed) are preserved
+        data = filepath.read_bytes()
+    except FileNotFoundError:
         print(f"Warning: {filepath} not found, skipping", file=sys.stderr)
         return False
+    except OSError as e:
+        print(f"Error reading {filepath}: {e}", file=sys.stderr)
+        return False
+
+    # Skip decoding entirely when the file has no image markup
+    if not _has_image_markup(data):
+        return False
 
     try:
-        # Read with newline='' to preserve original line endings (LF, CRLF, or mixed)
-        with open(filepath, "r", encoding="utf-8", newline="") as f:
-            original_content = f.read()
-    except Exception as e:
+        original_content = data.decode("utf-8")
+    except UnicodeDecodeError as e:
         print(f"Error reading {filepath}: {e}", file=sys.stderr)
         return False
 
-    normalized_content = normalize_image_urls(original_content, base_url)
+    return bool(_process_content(filepath, original_content, base_url, check_only))
 
-    if normalized_content == original_content:
-        # No changes needed
-        return False
 
-    if check_only:
-        print(f"{filepath}: Image URLs need normalization (use without --check-only to fix)")
-        return True
+_USAGE = "usage: check-readme-images [-h] [--check-only] [--ref REF] filenames [filenames ...]"
+
+_HELP = f"""{_USAGE}
+
+Normalize README image links to absolute HTTPS URLs for PyPI compatibility
+
+positional arguments:
+  filenames     Files to process (typically README.md or README.rst)
+
+options:
+  -h, --help    show this help message and exit
+  --check-only  Only check if normalization is needed, don't modify files
+  --ref REF     Git ref to pin URLs to (default: current commit SHA)
+"""
 
-    # Write changes with newline='' to preserve original line endings
-    try:
-        with open(filepath, "w", encoding="utf-8", newline="") as f:
-            f.write(normalized_content)
-        print(f"{filepath}: Normalized image URLs")
-        return True
-    except Exception as e:
-        print(f"Error writing {filepath}: {e}", file=sys.stderr)
-        return False
+
+def _usage_error(message: str) -> NoReturn:
+    """Print usage and an error message, then exit with status 2 like argparse."""
+    print(_USAGE, file=sys.stderr)
+    print(f"check-readme-images: error: {message}", file=sys.stderr)
+    raise SystemExit(2)
+
+
+def _parse_args(argv: list[str]) -> tuple[list[str], bool, str | None]:
+    """Parse command line arguments.
+
+    The hook only has two options, so this avoids the cost of importing and
+    building an argparse parser on every pre-commit run.
+
+    Args:
+        argv: Command line arguments without the program name
+
+    Returns:
+        tuple: (filenames, check_only, ref)
+    """
+    filenames: list[str] = []
+    check_only = False
+    ref = None
+
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-h", "--help"):
+            print(_HELP, end="")
+            raise SystemExit(0)
+        elif arg == "--check-only":
+            check_only = True
+        elif arg == "--ref":
+            ref = next(args, None)
+            if ref is None:
+                _usage_error("argument --ref: expected one argument")
+        elif arg.startswith("--ref="):
+            ref = arg[len("--ref="):]
+        elif arg == "--":
+            filenames.extend(args)
+        elif arg.startswith("-") and arg != "-":
+            _usage_error(f"unrecognized arguments: {arg}")
+        else:
+            filenames.append(arg)
+
+    if not filenames:
+        _usage_error("the following arguments are required: filenames")
+
+    return filenames, check_only, ref
 
 
 def main(argv: list[str] | None = None) -> int:
@@ -194,46 +421,81 @@ def main(argv: list[str] | None = None) -> int:
     Returns:
         int: 0 if no changes needed, 1 if changes were made/needed
     """
-    parser = argparse.ArgumentParser(
-        description="Normalize README image links to absolute HTTPS URLs for PyPI compatibility"
-    )
-    parser.add_argument(
-        "filenames",
-        nargs="+",
-        help="Files to process (typically README.md or README.rst)",
-    )
-    parser.add_argument(
-        "--check-only",
-        action="store_true",
-        help="Only check if normalization is needed, don't modify files",
-    )
-    parser.add_argument(
-        "--ref",
-        default=None,
-        help="Git ref to pin URLs to (default: current commit SHA)",
-    )
-
-    args = parser.parse_args(argv)
-
-    # Get repository info
-    git_info = get_git_info()
-    if git_info is None:
-        # Skip processing if not a GitHub repo or no commits yet
-        # This is not an error - just skip the hook
+    filenames, check_only, ref = _parse_args(sys.argv[1:] if argv is None else argv)
+
+    # Read all files up front and only query git if some file has image markup.
+    # Files already found clean are skipped by stat alone while unchanged.
+    clean_files = _load_clean_files()
+    clean_files_updated = False
+    contents: dict[str, str | None] = {}
+    stats: dict[str, os.stat_result] = {}
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+            if clean_files.get(filename) == [st.st_mtime_ns, st.st_size]:
+                continue
+            data = Path(filename).read_bytes()
+        except OSError:
+            # Leave reporting the problem to process_file
+            contents[filename] = None
+            continue
+
+        if not _has_image_markup(data):
+            clean_files_updated |= _record_clean(clean_files, filename, st)
+            continue
+
+        try:
+            contents[filename] = data.decode("utf-8")
+        except UnicodeDecodeError:
+            contents[filename] = None
+            continue
+        stats[filename] = st
+
+    if clean_files_updated:
+        _save_clean_files(clean_files)
+
+    if not contents:
         return 0
 
-    repo_path, default_ref = git_info
+    # Get repository info; the current commit is only needed when no ref is given.
+    # Skip processing if not a GitHub repo or no commits yet.
+    # This is not an error - just skip the hook
+    if ref:
+        repo_path = _get_repo_path()
+        if repo_path is None:
+            return 0
+    else:
+        git_info = get_git_info()
+        if git_info is None:
+            return 0
+        repo_path, ref = git_info
 
-    # Use specified ref or default to current commit
-    ref = args.ref if args.ref else default_ref
     base_url = f"https://raw.githubusercontent.com/{repo_path}/{ref}/"
 
-    # Process all files
-    any_changes = False
-    for filename in args.filenames:
-        filepath = Path(filename)
-        if process_file(filepath, base_url, check_only=args.check_only):
-            any_changes = True
+    # Process files with image markup, overlapping file I/O when there are several
+    def process(filename: str) -> bool | None:
+        content = contents[filename]
+        if content is None:
+            # Unreadable or undecodable: process_file reports it, and it is never cached
+            return process_file(Path(filename), base_url, check_only=check_only) or None
+        return _process_content(Path(filename), content, base_url, check_only)
+
+    if len(contents) == 1:
+        results = [process(next(iter(contents)))]
+    else:
+        # Only multi-file runs pay for importing concurrent.futures
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(8, len(contents))) as executor:
+            results = list(executor.map(process, contents))
+    any_changes = any(results)
+
+    clean_files_updated = False
+    for filename, result in zip(contents, results):
+        if result is False:
+            clean_files_updated |= _record_clean(clean_files, filename, stats[filename])
+    if clean_files_updated:
+        _save_clean_files(clean_files)
 
     # Exit with non-zero if any changes were made (pre-commit convention)
     return 1 if any_changes else 0
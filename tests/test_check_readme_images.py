@@ -1,18 +1,46 @@
 """Tests for flowreg_hooks.check_readme_images."""
 
+import json
+import os
 import subprocess
 import pytest
 
-from flowreg_hooks.check_readme_images import get_git_info, main, normalize_image_urls, process_file
+from flowreg_hooks.check_readme_images import (
+    _compile_image_patterns,
+    _get_repo_path,
+    _invalidate_git_info_cache,
+    get_git_info,
+    main,
+    normalize_image_urls,
+    process_file,
+)
 
 BASE = "https://raw.githubusercontent.com/owner/repo/sha/"
 
 
+@pytest.fixture(autouse=True)
+def clear_git_info_cache():
+    """Ensure each test sees the git state of its own working directory."""
+    _invalidate_git_info_cache()
+    yield
+    _invalidate_git_info_cache()
+
+
+@pytest.fixture(autouse=True)
+def isolated_clean_cache(tmp_path_factory, monkeypatch):
+    """Keep the clean-file cache out of the repository running the tests."""
+    cache_path = tmp_path_factory.mktemp("cache") / "flowreg-hooks-cache.json"
+    monkeypatch.setattr("flowreg_hooks.check_readme_images._CACHE_PATH", cache_path)
+    return cache_path
+
+
 @pytest.mark.parametrize(
     "content,expected",
     [
         ("![alt](docs/img.png)", "![alt](" + BASE + "docs/img.png)"),
         ("![x](./assets/Logo.JPG)", "![x](" + BASE + "assets/Logo.JPG)"),
+        ("![r](/docs/img.png)", "![r](" + BASE + "docs/img.png)"),
+        ("![p](../img/x.png)", "![p](" + BASE + "../img/x.png)"),
         ("![y](http://example.com/p.png)", "![y](http://example.com/p.png)"),
         ("![z](https://example.com/p.png)", "![z](https://example.com/p.png)"),
         ("![notimg](docs/file.txt)", "![notimg](docs/file.txt)"),
@@ -32,6 +60,81 @@ def test_normalize_html_img_double_quotes():
     assert out == expected
 
 
+@pytest.mark.parametrize(
+    "content",
+    [
+        '<img data-src="docs/real.png" src="https://placeholder/x.gif">',
+        '<img data-src="docs/real.png" src="data:image/gif;base64,AAA">',
+        '<img data-src="a.png" src="b.txt">',
+    ],
+)
+def test_normalize_html_img_ignores_data_src(content):
+    """Test that only the src attribute is rewritten, never data-src."""
+    assert normalize_image_urls(content, BASE) == content
+
+
+def test_normalize_html_img_src_after_data_src():
+    """Test a relative src is still rewritten when data-src comes first."""
+    content = '<img data-src="a.png" src="b.png">'
+    expected = '<img data-src="a.png" src="' + BASE + 'b.png">'
+    assert normalize_image_urls(content, BASE) == expected
+
+
+def test_normalize_html_img_uppercase_tag():
+    """Test HTML img tag normalization is case-insensitive."""
+    content = '<IMG SRC="img/logo.svg">'
+    expected = '<IMG SRC="' + BASE + 'img/logo.svg">'
+    out = normalize_image_urls(content, BASE)
+    assert out == expected
+
+
+def test_normalize_mixed_markdown_and_html():
+    """Test Markdown and HTML images in the same content are both normalized."""
+    content = '![a](img/a.png)\n<img src="img/b.gif" width="100">\n'
+    expected = "![a](" + BASE + 'img/a.png)\n<img src="' + BASE + 'img/b.gif" width="100">\n'
+    out = normalize_image_urls(content, BASE)
+    assert out == expected
+
+
+def test_normalize_custom_extensions():
+    """Test that a custom allowed_extensions set restricts which images are rewritten."""
+    content = "![a](img/a.png) ![b](img/b.webp)"
+    expected = "![a](img/a.png) ![b](" + BASE + "img/b.webp)"
+    out = normalize_image_urls(content, BASE, allowed_extensions={".webp"})
+    assert out == expected
+    assert normalize_image_urls(content, BASE, allowed_extensions=set()) is content
+
+
+def test_custom_extension_pattern_is_cached():
+    """Test that the pattern for a custom allow-list is compiled once and reused."""
+    _compile_image_patterns.cache_clear()
+    normalize_image_urls("![a](img/a.webp)", BASE, allowed_extensions={".webp"})
+    normalize_image_urls("![b](img/b.webp)", BASE, allowed_extensions={".webp"})
+    info = _compile_image_patterns.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+def test_normalize_without_image_markup():
+    """Test content without image markup is returned unchanged."""
+    content = "# Title\n\nSee [docs](docs/index.md).\n"
+    assert normalize_image_urls(content, BASE) == content
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "# Title\n",
+        "![y](https://example.com/p.png)",
+        "![notimg](docs/file.txt)",
+        '<img src="https://example.com/p.png">',
+    ],
+)
+def test_normalize_returns_same_object_when_unchanged(content):
+    """Test that content without relative images is returned as the same object."""
+    assert normalize_image_urls(content, BASE) is content
+
+
 def test_idempotence():
     """Test that normalization is idempotent."""
     content = "![alt](pics/a.jpg)"
@@ -58,6 +161,50 @@ def test_process_file_writes(tmp_path):
     assert p.read_text(encoding="utf-8") == "![a](" + BASE + "img/x.png)"
 
 
+def test_process_file_write_keeps_permissions(tmp_path):
+    """Test process_file replaces the file in place without leftover temp files."""
+    p = tmp_path / "README.md"
+    p.write_text("![a](img/x.png)", encoding="utf-8")
+    p.chmod(0o640)
+    changed = process_file(p, BASE, check_only=False)
+    assert changed
+    assert p.stat().st_mode & 0o777 == 0o640
+    assert [f.name for f in tmp_path.iterdir()] == ["README.md"]
+
+
+def test_process_file_write_falls_back_to_in_place(monkeypatch, tmp_path):
+    """Test process_file writes in place when the atomic rename is refused."""
+    p = tmp_path / "README.md"
+    p.write_text("![a](img/x.png)", encoding="utf-8")
+
+    def refuse_replace(src, dst):
+        raise PermissionError("file is in use")
+
+    monkeypatch.setattr("flowreg_hooks.check_readme_images.os.replace", refuse_replace)
+    changed = process_file(p, BASE, check_only=False)
+    assert changed
+    assert p.read_text(encoding="utf-8") == "![a](" + BASE + "img/x.png)"
+    assert [f.name for f in tmp_path.iterdir()] == ["README.md"]
+
+
+def test_process_file_missing(tmp_path, capsys):
+    """Test process_file warns and skips a file that does not exist."""
+    p = tmp_path / "README.md"
+    changed = process_file(p, BASE, check_only=False)
+    assert not changed
+    assert "not found, skipping" in capsys.readouterr().err
+
+
+def test_process_file_without_image_markup(tmp_path):
+    """Test process_file skips files without image markup before decoding them."""
+    p = tmp_path / "README.rst"
+    # Not valid UTF-8, but never decoded since there is no image markup
+    p.write_bytes("Caf\xe9\n".encode("latin-1"))
+    changed = process_file(p, BASE, check_only=False)
+    assert not changed
+    assert p.read_bytes() == "Caf\xe9\n".encode("latin-1")
+
+
 def test_main_exit_codes(monkeypatch, tmp_path):
     """Test main function exit codes."""
     readme = tmp_path / "README.md"
@@ -83,6 +230,131 @@ def test_main_exit_codes(monkeypatch, tmp_path):
     assert rc == 0
 
 
+def test_main_ref_option(monkeypatch, tmp_path):
+    """Test --ref in both separate and --ref=VALUE forms pins the URLs without resolving HEAD."""
+
+    def fail_git_info():
+        raise AssertionError("get_git_info() should not be called when --ref is given")
+
+    monkeypatch.setattr("flowreg_hooks.check_readme_images.get_git_info", fail_git_info)
+    monkeypatch.setattr("flowreg_hooks.check_readme_images._get_repo_path", lambda: "owner/repo")
+    for args in (["--ref", "v1.0.0"], ["--ref=v1.0.0"]):
+        readme = tmp_path / "README.md"
+        readme.write_text("![a](img/x.png)", encoding="utf-8")
+        assert main([*args, str(readme)]) == 1
+        expected = "![a](https://raw.githubusercontent.com/owner/repo/v1.0.0/img/x.png)"
+        assert readme.read_text(encoding="utf-8") == expected
+
+
+@pytest.mark.parametrize(
+    "argv,code",
+    [
+        (["--help"], 0),
+        ([], 2),
+        (["--check-only"], 2),
+        (["README.md", "--ref"], 2),
+        (["README.md", "--unknown"], 2),
+    ],
+)
+def test_main_usage(argv, code, capsys):
+    """Test help output and usage errors exit like argparse did."""
+    with pytest.raises(SystemExit) as excinfo:
+        main(argv)
+    assert excinfo.value.code == code
+    out, err = capsys.readouterr()
+    assert "usage: check-readme-images" in (out if code == 0 else err)
+
+
+def test_main_multiple_files(monkeypatch, tmp_path):
+    """Test main processes every file when several are passed."""
+    readmes = []
+    for i in range(3):
+        readme = tmp_path / f"README{i}.md"
+        readme.write_text(f"![a](img/{i}.png)", encoding="utf-8")
+        readmes.append(readme)
+    clean = tmp_path / "README.rst"
+    clean.write_text("No images here", encoding="utf-8")
+
+    monkeypatch.setattr(
+        "flowreg_hooks.check_readme_images.get_git_info", lambda: ("owner/repo", "sha")
+    )
+
+    rc = main([str(p) for p in [*readmes, clean]])
+    assert rc == 1
+    for i, readme in enumerate(readmes):
+        assert readme.read_text(encoding="utf-8") == "![a](" + BASE + f"img/{i}.png)"
+    assert clean.read_text(encoding="utf-8") == "No images here"
+
+    rc = main([str(p) for p in [*readmes, clean]])
+    assert rc == 0
+
+
+def test_main_skips_git_without_image_markup(monkeypatch, tmp_path):
+    """Test main does not query git when no file contains image markup."""
+    readme = tmp_path / "README.md"
+    readme.write_text("# Title\n\nNo images here.\n", encoding="utf-8")
+
+    def fail_git_info():
+        raise AssertionError("get_git_info() should not be called")
+
+    monkeypatch.setattr("flowreg_hooks.check_readme_images.get_git_info", fail_git_info)
+
+    assert main([str(readme)]) == 0
+    assert main([str(readme), "--check-only"]) == 0
+
+
+def test_main_skips_cached_clean_files(monkeypatch, tmp_path, isolated_clean_cache):
+    """Test main skips files recorded as clean while their mtime and size are unchanged."""
+    readme = tmp_path / "README.md"
+    readme.write_text("![a](https://example.com/a.png)", encoding="utf-8")
+    # Back-date the file so its mtime is trusted by the cache
+    old = readme.stat().st_mtime_ns - 10_000_000_000
+    os.utime(readme, ns=(old, old))
+
+    monkeypatch.setattr(
+        "flowreg_hooks.check_readme_images.get_git_info", lambda: ("owner/repo", "sha")
+    )
+
+    assert main([str(readme), "--check-only"]) == 0
+    cache = json.loads(isolated_clean_cache.read_text(encoding="utf-8"))
+    assert str(readme) in cache["files"]
+
+    # Same size and mtime: the file is not read again
+    readme.write_text("![a](img/xxxxxxxxxxxxxxxxx.png)", encoding="utf-8")
+    os.utime(readme, ns=(old, old))
+    assert main([str(readme), "--check-only"]) == 0
+
+    # A new mtime invalidates the cached entry
+    os.utime(readme, ns=(old + 1, old + 1))
+    assert main([str(readme), "--check-only"]) == 1
+
+
+def test_main_reports_undecodable_file(monkeypatch, tmp_path, capsys, isolated_clean_cache):
+    """Test main reports a non-UTF-8 file with image markup and does not cache it."""
+    readme = tmp_path / "README.md"
+    readme.write_bytes("![caf\xe9](img/x.png)".encode("latin-1"))
+    old = readme.stat().st_mtime_ns - 10_000_000_000
+    os.utime(readme, ns=(old, old))
+
+    monkeypatch.setattr(
+        "flowreg_hooks.check_readme_images.get_git_info", lambda: ("owner/repo", "sha")
+    )
+
+    assert main([str(readme)]) == 0
+    assert "Error reading" in capsys.readouterr().err
+    assert not isolated_clean_cache.exists()
+
+
+def test_get_repo_path_without_commits(tmp_path, monkeypatch):
+    """Test _get_repo_path() works before the first commit, unlike get_git_info()."""
+    monkeypatch.chdir(tmp_path)
+    subprocess.run(["git", "init"], check=True)
+    subprocess.run(["git", "remote", "add", "origin", "https://github.com/owner/repo.git"], check=True)
+
+    assert _get_repo_path() == "owner/repo"
+    assert get_git_info() is None
+
+
 def test_get_git_info_no_commits(tmp_path, monkeypatch):
     """Test get_git_info() when there are no commits yet (initial commit scenario)."""
     # Create a fresh git repo with no commits
@@ -211,3 +483,24 @@ def test_preserve_line_endings_crlf(tmp_path):
     # Verify content was actually changed
     result_text = result_bytes.decode("utf-8")
     assert BASE + "img/x.png" in result_text
+
+
+def test_get_git_info_is_cached(tmp_path, monkeypatch):
+    """Test that get_git_info() only queries git once per process."""
+    monkeypatch.chdir(tmp_path)
+    subprocess.run(["git", "init"], check=True)
+    subprocess.run(["git", "config", "user.email", "test@example.com"], check=True)
+    subprocess.run(["git", "config", "user.name", "Test User"], check=True)
+    subprocess.run(["git", "remote", "add", "origin", "git@github.com:owner/repo.git"], check=True)
+    subprocess.run(["git", "commit", "--allow-empty", "-m", "Initial commit"], check=True)
+
+    first = get_git_info()
+    assert first is not None
+    assert first[0] == "owner/repo"
+
+    # A new commit is not picked up until the cache is invalidated
+    subprocess.run(["git", "commit", "--allow-empty", "-m", "Second commit"], check=True)
+    assert get_git_info() == first
+
+    _invalidate_git_info_cache()
+    assert get_git_info() != first